@@ -1,9 +1,15 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
+from indicators import rsi_ewm, ema_last  # kernel JIT; modul diimpor sekali per proses
 from datetime import datetime
-import time, requests, string, io
+from zoneinfo import ZoneInfo
+import requests, string, io, re, time
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 st.set_page_config(page_title="IDX Stock Screener", page_icon="📈", layout="wide")
 
@@ -11,10 +17,12 @@ st.title("📈 IDX Stock Screener")
 st.markdown("**Filter saham: % kenaikan, jumlah hari berturut-turut, dan volume perdagangan**")
 
 # ---------- Small static fallback (agar tak pernah 0) ----------
-STATIC_FALLBACK = [
+# tuple unik & terurut (sama seperti hasil Yahoo/IDX), dibangun sekali saat import
+STATIC_FALLBACK = tuple(sorted({
     "BBCA.JK","BBRI.JK","BMRI.JK","BBNI.JK","TLKM.JK","ASII.JK","UNVR.JK","HMSP.JK","ICBP.JK","KLBF.JK",
-    "INDF.JK","GGRM.JK","UNTR.JK","ADRO.JK","PTBA.JK","ANTM.JK","TOWR.JK","ISAT.JK","EXCL.JK","PGAS.JK"
-]
+    "INDF.JK","GGRM.JK","UNTR.JK","ADRO.JK","PTBA.JK","ANTM.JK","TOWR.JK","ISAT.JK","EXCL.JK","PGAS.JK",
+}))
+STATIC_NAME_MAP = {s: s[:-3] for s in STATIC_FALLBACK}
 
 # ---------- Helpers ----------
 def format_idr(value):
@@ -29,27 +37,33 @@ def format_idr(value):
     else:
         return f"Rp {value:,.0f}"
 
+# satu session untuk semua request JSON → koneksi keep-alive dipakai ulang
+_SESSION = requests.Session()
+# 429/5xx (throttle Yahoo) ikut dicoba ulang, menghormati Retry-After
+_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)))
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)
+
 def _try_get_json(url, params=None, headers=None, timeout=15):
     try:
-        r = requests.get(url, params=params or {}, headers=headers or {}, timeout=timeout)
+        r = _SESSION.get(url, params=params or {}, headers=headers or {}, timeout=timeout)
         r.raise_for_status()
         return r.json(), None
     except Exception as e:
         return None, str(e)
 
-def _clean_to_jk_symbol(s: str) -> str:
-    s = (s or "").strip().upper()
-    if not s:
-        return ""
-    if s.endswith(".JK"):
-        return s
-    # buang spasi/komentar
-    s = s.split()[0].strip()
-    # buang tanda baca umum
-    s = s.replace(",", "").replace(";", "").replace(".", "")
-    if not s:
-        return ""
-    return s + ".JK"
+class IncompleteListing(Exception):
+    """Daftar kosong/sebagian: dilempar dari fungsi ber-cache disk supaya tidak ikut tersimpan."""
+    def __init__(self, result):
+        super().__init__("; ".join(result[2]))
+        self.result = result
+
+def _clean_to_jk_symbols(values) -> pd.Series:
+    s = pd.Series(values, dtype=object).astype(str).str.strip().str.upper()
+    s = s[s != ""]  # baris kosong dibuang dulu; kalau tidak, .str[0] jadi NaN semua
+    # buang spasi/komentar, lalu tanda baca umum; yang sudah ber-.JK dibiarkan
+    cleaned = s.str.split().str[0].str.replace(r"[,;.]", "", regex=True) + ".JK"
+    return cleaned.where(~s.str.endswith(".JK"), s)
 
 # ---------- Yahoo search (lebih stabil) ----------
 YA_SEARCH = "https://query2.finance.yahoo.com/v1/finance/search"
@@ -59,66 +73,80 @@ BROWSER_HEADERS = {
     "Accept-Language": "en-US,en;q=0.9",
 }
 
-@st.cache_data(ttl=3600)
+YAHOO_SEARCH_WORKERS = 8
+YAHOO_QUERIES = tuple(string.ascii_uppercase + string.digits)
+# waran/right/dll: "-W", "-R", "-B", "-TB", "-F", "-P", "-S", "-Q" di mana pun dalam simbol
+_BAD_SUFFIX = re.compile(r"-(?:TB|[WRBFPSQ])")
+
+def _fetch_one_letter(q):
+    js, err = _try_get_json(
+        YA_SEARCH,
+        params={"q": q, "quotesCount": 1000, "newsCount": 0, "lang": "en-US", "region": "US"},
+        headers=BROWSER_HEADERS,
+        timeout=12
+    )
+    if err or not js:
+        return {}, f"Yahoo {q}: {err or 'no data'}"
+
+    found = {}
+    for it in (js.get("quotes") or []):
+        sym = (it.get("symbol") or "").upper()
+        exch = (it.get("exchange") or it.get("exch") or "").upper()
+        exch_disp = (it.get("exchDisp") or it.get("exchangeDisp") or "").lower()
+        name = it.get("shortname") or it.get("longname") or it.get("name") or sym
+        if sym.endswith(".JK") or exch in {"JKT", "JAKARTA", "IDX"} or "jakarta" in exch_disp:
+            found[sym] = name
+    return found, None
+
+@st.cache_data(persist="disk")
 def fetch_from_yahoo_search_verbose():
     tickers = {}
     errors = []
-    queries = list(string.ascii_uppercase) + list(string.digits)
-
-    for q in queries:
-        js, err = _try_get_json(
-            YA_SEARCH,
-            params={"q": q, "quotesCount": 1000, "newsCount": 0, "lang": "en-US", "region": "US"},
-            headers=BROWSER_HEADERS,
-            timeout=12
-        )
-        if err or not js:
-            errors.append(f"Yahoo {q}: {err or 'no data'}")
-            time.sleep(0.05)
-            continue
-
-        for it in (js.get("quotes") or []):
-            sym = (it.get("symbol") or "").upper()
-            exch = (it.get("exchange") or it.get("exch") or "").upper()
-            exch_disp = (it.get("exchDisp") or it.get("exchangeDisp") or "").lower()
-            name = it.get("shortname") or it.get("longname") or it.get("name") or sym
-            if sym.endswith(".JK") or exch in {"JKT", "JAKARTA", "IDX"} or "jakarta" in exch_disp:
-                tickers[sym] = name
-        time.sleep(0.08)
+    # query saling independen → jalan paralel, jumlah worker sekaligus jadi throttle
+    with ThreadPoolExecutor(max_workers=YAHOO_SEARCH_WORKERS) as ex:
+        results = list(ex.map(_fetch_one_letter, YAHOO_QUERIES))
+    # semua query wajib selesai: tak ada batas jumlah emiten yang aman untuk berhenti lebih awal
+    for found, err in results:
+        if err:
+            errors.append(err)
+        tickers.update(found)
 
     # light cleaning
     cleaned = {}
     for sym, name in tickers.items():
-        bad_suffix = any(suf in sym for suf in ["-W", "-R", "-B", "-TB", "-F", "-P", "-S", "-Q"])
-        if bad_suffix:
+        if _BAD_SUFFIX.search(sym):
             continue
         if len(sym) <= 3:
             continue
         cleaned[sym] = name
 
     final_map = cleaned if cleaned else tickers
-    return sorted(final_map.keys()), final_map, errors
+    result = sorted(final_map.keys()), final_map, errors
+    if errors or not final_map:
+        raise IncompleteListing(result)
+    return (*result, _listing_day())
 
 # ---------- IDX fetch (kadang 403/blocked di Replit) ----------
-@st.cache_data(ttl=3600)
+@st.cache_data(persist="disk")
 def fetch_from_idx_verbose():
     url = "https://www.idx.co.id/umbraco/Surface/ListedCompany/GetListedCompany?emitenType=s"
     js, err = _try_get_json(url, headers={"Referer": "https://www.idx.co.id/"}, timeout=15)
     if err or not isinstance(js, list):
-        return [], {}, [f"IDX: {err or 'no data/list'}"]
-    syms, names = [], {}
+        raise IncompleteListing(([], {}, [f"IDX: {err or 'no data/list'}"]))
+    names = {}
     for row in js:
         code = str(row.get("KodeEmiten") or "").strip().upper()
         name = (row.get("NamaEmiten") or row.get("NamaPerusahaan") or code).strip()
         if code and code.isalnum():
-            sym = f"{code}.JK"
-            syms.append(sym); names[sym] = name
-    syms = sorted(set(syms))
-    return syms, names, []
+            names[f"{code}.JK"] = name
+    if not names:
+        raise IncompleteListing(([], {}, ["IDX: no data/list"]))
+    # key dict sudah unik → cukup satu kali sort
+    return sorted(names), names, [], _listing_day()
 
 # ---------- Manual (Upload/Tempel) ----------
 def fetch_from_manual(text_value: str, uploaded_file) -> tuple[list, dict]:
-    symbols = []
+    raw = []
     if uploaded_file is not None:
         try:
             if uploaded_file.name.lower().endswith(".csv"):
@@ -126,210 +154,411 @@ def fetch_from_manual(text_value: str, uploaded_file) -> tuple[list, dict]:
             else:
                 df = pd.read_excel(uploaded_file)
             # cari kolom yang memuat kode (heuristik sederhana)
-            candidate_cols = [c for c in df.columns if "code" in c.lower() or "ticker" in c.lower() or "symbol" in c.lower() or "kode" in c.lower()]
-            if not candidate_cols:
+            candidate_cols = df.columns[df.columns.astype(str).str.contains(r"code|ticker|symbol|kode", case=False, regex=True)]
+            if not len(candidate_cols):
                 candidate_cols = [df.columns[0]]
-            codes = df[candidate_cols[0]].astype(str).tolist()
-            symbols.extend([_clean_to_jk_symbol(c) for c in codes])
+            raw.extend(df[candidate_cols[0]].astype(str).tolist())
         except Exception:
             pass
     # gabung teks manual
     if text_value:
-        lines = [ln.strip() for ln in text_value.splitlines() if ln.strip()]
-        symbols.extend([_clean_to_jk_symbol(ln) for ln in lines])
+        raw.extend(text_value.splitlines())
     # bersihkan
-    symbols = sorted({s for s in symbols if s.endswith(".JK") and len(s) >= 5})
+    cleaned = _clean_to_jk_symbols(raw).dropna()
+    cleaned = cleaned[cleaned.str.endswith(".JK") & (cleaned.str.len() >= 5)]
+    # unik + urut sekaligus di NumPy
+    symbols = np.unique(cleaned.to_numpy(dtype=str)).tolist()
     name_map = {s: s.replace(".JK", "") for s in symbols}
     return symbols, name_map
 
 # ---------- Resolve universe ----------
+JKT_TZ = ZoneInfo("Asia/Jakarta")
+
+def _market_open():
+    now = datetime.now(JKT_TZ)
+    return now.weekday() < 5 and 9 <= now.hour < 16  # sesi bursa 09:00-16:00 WIB
+
+LISTING_RETRY_TTL = 3600  # hasil kosong/sebagian disimpan di memori 1 jam (seperti dulu), bukan tiap rerun
+
+@st.cache_data(ttl=LISTING_RETRY_TTL, show_spinner=False)
+def _fetch_listing(source, day):
+    fetch_fn = fetch_from_yahoo_search_verbose if source == "yahoo" else fetch_from_idx_verbose
+    try:
+        # hanya hasil lengkap yang sampai ke cache disk
+        *result, fetched_day = fetch_fn()
+        if fetched_day != day:
+            # satu entry per sumber di disk; milik hari sebelumnya diganti, tidak menumpuk
+            fetch_fn.clear()
+            *result, fetched_day = fetch_fn()
+        return tuple(result)
+    except IncompleteListing as e:
+        # kosong/sebagian cukup diingat di memori (LISTING_RETRY_TTL)
+        return e.result
+
+def _listing_day():
+    # cache disk tak kenal ttl → tanggal (WIB) ikut disimpan, daftar emiten diambil ulang tiap hari
+    return datetime.now(JKT_TZ).date().isoformat()
+
 def resolve_universe(mode: str, manual_text: str = "", manual_file=None):
     debug_msgs = []
     if mode == "Yahoo only":
-        syms, names, errs = fetch_from_yahoo_search_verbose()
+        syms, names, errs = _fetch_listing("yahoo", _listing_day())
         debug_msgs.extend(errs)
         if not syms:
             debug_msgs.append("Yahoo empty → fallback STATIC")
-            return STATIC_FALLBACK, {s: s.replace(".JK", "") for s in STATIC_FALLBACK}, debug_msgs
+            return STATIC_FALLBACK, STATIC_NAME_MAP, debug_msgs
         return syms, names, debug_msgs
 
     if mode == "IDX only":
-        syms, names, errs = fetch_from_idx_verbose()
+        syms, names, errs = _fetch_listing("idx", _listing_day())
         debug_msgs.extend(errs)
         if not syms:
             debug_msgs.append("IDX empty → fallback STATIC")
-            return STATIC_FALLBACK, {s: s.replace(".JK", "") for s in STATIC_FALLBACK}, debug_msgs
+            return STATIC_FALLBACK, STATIC_NAME_MAP, debug_msgs
         return syms, names, debug_msgs
 
     if mode == "Manual":
         syms, names = fetch_from_manual(manual_text, manual_file)
         if not syms:
             debug_msgs.append("Manual empty → fallback STATIC")
-            return STATIC_FALLBACK, {s: s.replace(".JK", "") for s in STATIC_FALLBACK}, debug_msgs
+            return STATIC_FALLBACK, STATIC_NAME_MAP, debug_msgs
         return syms, names, debug_msgs
 
     # Auto: Yahoo → IDX → STATIC
-    syms, names, errs = fetch_from_yahoo_search_verbose()
+    syms, names, errs = _fetch_listing("yahoo", _listing_day())
     debug_msgs.extend(errs)
     if syms:
         return syms, names, debug_msgs
-    syms2, names2, errs2 = fetch_from_idx_verbose()
+    syms2, names2, errs2 = _fetch_listing("idx", _listing_day())
     debug_msgs.extend(errs2)
     if syms2:
         return syms2, names2, debug_msgs
     debug_msgs.append("Auto empty → fallback STATIC")
-    return STATIC_FALLBACK, {s: s.replace(".JK", "") for s in STATIC_FALLBACK}, debug_msgs
+    return STATIC_FALLBACK, STATIC_NAME_MAP, debug_msgs
 
 # ---------- Data & indicators ----------
-@st.cache_data(ttl=600, show_spinner=False)
-def get_stock_data(ticker, period="5d"):
-    stock = yf.Ticker(ticker)
-    hist = stock.history(period=period, auto_adjust=False)
-    info = {}
-    try:
-        info_full = stock.info
-        if isinstance(info_full, dict):
-            info["longName"] = info_full.get("longName")
-    except Exception:
-        pass
-    return hist, info
-
-def check_consecutive_day_increase(hist, threshold=2.0, num_days=2):
-    if hist is None or len(hist) < (num_days + 1):
+SCAN_WORKERS = 16  # jumlah request Yahoo yang jalan bersamaan saat scan
+YF_BATCH_SIZE = 200  # jumlah ticker per panggilan yf.download
+STREAM_EVERY = 20  # hasil sementara diperbarui tiap sekian ticker selesai
+SCAN_COLUMNS = ("Close", "Volume")  # cukup untuk filter kenaikan & nilai transaksi
+OHLCV_COLUMNS = ("Open", "High", "Low", "Close", "Volume")  # indikator + grafik dari data scan
+
+PRICE_COLUMNS = ("Open", "High", "Low", "Close")
+
+def _slim_history(hist, columns):
+    # hanya kolom yang dipakai; harga cukup float32 (Volume tetap int64)
+    hist = hist[[c for c in columns if c in hist.columns]]
+    prices = [c for c in PRICE_COLUMNS if c in hist.columns]
+    return hist.astype({c: np.float32 for c in prices})
+
+@st.cache_resource(show_spinner=False)
+def _ticker(sym):
+    # yfinance sudah berbagi satu session untuk semua Ticker; objeknya jangan diubah
+    return yf.Ticker(sym)
+
+def price_cache_slot():
+    """Key waktu untuk cache harga: ganti tiap menit saat jam bursa, tiap jam di luar itu."""
+    step = 60 if _market_open() else 3600
+    return int(time.time() // step)
+
+# panggilan bersamaan untuk key yang sama sudah menunggu satu fetch (lock per-key di st.cache_data)
+@st.cache_data(ttl=3600, show_spinner=False)
+def _stock_data_cached(ticker, period, columns, slot):
+    return _slim_history(_ticker(ticker).history(period=period, auto_adjust=False), columns)
+
+def get_stock_data(ticker, period="5d", columns=SCAN_COLUMNS):
+    return _stock_data_cached(ticker, period, columns, price_cache_slot())
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _download_batch(tickers, period="5d", columns=SCAN_COLUMNS, slot=None):
+    data = yf.download(list(tickers), period=period, group_by="ticker", threads=True, auto_adjust=False, progress=False)
+    histories = {}
+    if data is None or data.empty:
+        return histories
+    available = set(data.columns.get_level_values(0))
+    for t in tickers:
+        if t in available:
+            hist = _slim_history(data[t], columns).dropna(subset=["Close"])
+            if len(hist):
+                histories[t] = hist
+    return histories
+
+def fetch_histories_batched(tickers, period="5d", chunk=YF_BATCH_SIZE, columns=SCAN_COLUMNS, on_chunk=None):
+    """Satu request yf.download per `chunk` ticker; ticker yang gagal tidak ada di hasil.
+    `on_chunk(selesai, total, histories_chunk)` dipanggil setelah tiap chunk (progress bar & hasil sementara)."""
+    histories = {}
+    slot = price_cache_slot()  # satu slot untuk semua chunk → satu scan tetap konsisten
+    for i in range(0, len(tickers), chunk):
+        try:
+            batch = _download_batch(tuple(tickers[i:i + chunk]), period, columns, slot)
+        except Exception:
+            batch = {}
+        histories.update(batch)
+        if on_chunk is not None:
+            on_chunk(min(i + chunk, len(tickers)), len(tickers), batch)
+    return histories
+
+def check_consecutive_day_increase(close, threshold=2.0, num_days=2):
+    # panjang data sudah dicek pemanggil (process_single_stock)
+    prices = close[-(num_days + 1):]
+    # mayoritas saham sudah gagal di hari terakhir → cek itu dulu sebelum hitung semua
+    if (prices[-1] - prices[-2]) / prices[-2] * 100.0 < threshold:
         return False, [], []
-    recent = hist.tail(num_days + 1)
-    prices = recent['Close'].values
-    changes = [((prices[i + 1] - prices[i]) / prices[i]) * 100 for i in range(len(prices) - 1)]
-    if all(ch >= threshold for ch in changes):
-        return True, changes, list(prices)
-    return False, changes, list(prices)
-
-def calculate_trading_value(hist):
-    if hist is None or len(hist) < 1:
-        return 0
-    r = hist.tail(1)
-    return float(r['Close'].values[0]) * float(r['Volume'].values[0])
+    changes = np.diff(prices) / prices[:-1] * 100.0
+    return bool(np.all(changes >= threshold)), changes.tolist(), prices.tolist()
 
-def calculate_rsi(hist, period=14):
-    if hist is None or len(hist) < period + 1:
+def calculate_trading_value(close, volumes):
+    return float(close[-1]) * float(volumes[-1])
+
+def calculate_rsi(close, period=14):
+    if len(close) < period + 1:
         return None
-    prices = hist['Close'].values
-    deltas = pd.Series(prices).diff()
-    gains = deltas.where(deltas > 0, 0)
-    losses = -deltas.where(deltas < 0, 0)
-    avg_gain = gains.ewm(alpha=1/period, adjust=False).mean()
-    avg_loss = losses.ewm(alpha=1/period, adjust=False).mean()
-    lg, ll = avg_gain.iloc[-1], avg_loss.iloc[-1]
+    lg, ll = rsi_ewm(close, period)
     if ll == 0: return 100.0 if lg > 0 else 50.0
     if lg == 0: return 0.0
     rs = lg / ll
     rsi = 100 - (100 / (1 + rs))
-    return rsi if not pd.isna(rsi) else None
+    return rsi if not np.isnan(rsi) else None
 
-def calculate_sma(hist, period=20):
-    if hist is None or len(hist) < period:
+def calculate_sma(close, period=20):
+    if len(close) < period:
         return None
-    sma = hist['Close'].rolling(window=period).mean()
-    return sma.iloc[-1] if not pd.isna(sma.iloc[-1]) else None
+    sma = close[-period:].mean()
+    return sma if not np.isnan(sma) else None
 
-def calculate_ema(hist, period=20):
-    if hist is None or len(hist) < period:
+def calculate_ema(close, period=20):
+    if len(close) < period:
         return None
-    ema = hist['Close'].ewm(span=period, adjust=False).mean()
-    return ema.iloc[-1] if not pd.isna(ema.iloc[-1]) else None
+    ema = ema_last(close, period)
+    return ema if not np.isnan(ema) else None
 
-def calculate_volume_trend(hist, period=5):
-    if hist is None or len(hist) < period * 2:
+def calculate_volume_trend(volumes, period=5):
+    if len(volumes) < period * 2:
         return None
-    volumes = hist['Volume'].values
-    recent_avg = sum(volumes[-period:]) / period
-    previous_avg = sum(volumes[-period*2:-period]) / period
+    recent_avg = volumes[-period:].mean()
+    previous_avg = volumes[-period*2:-period].mean()
     if previous_avg == 0:
         return None
     return ((recent_avg - previous_avg) / previous_avg) * 100
 
-def create_stock_chart(ticker, period="3mo", name_map=None):
-    try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period=period)
-        if hist is None or len(hist) < 1:
-            return None
-        stock_name = (name_map or {}).get(ticker) or ticker.replace(".JK", "")
-        from plotly.subplots import make_subplots
-        import plotly.graph_objects as go
-        fig = make_subplots(
-            rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.03,
-            subplot_titles=(f'{stock_name} ({ticker.replace(".JK", "")})', 'Volume'),
-            row_heights=[0.7, 0.3]
-        )
-        fig.add_trace(go.Candlestick(
-            x=hist.index, open=hist['Open'], high=hist['High'],
-            low=hist['Low'], close=hist['Close'], name='Price'
-        ), row=1, col=1)
-        colors = ['red' if hist['Close'].iloc[i] < hist['Open'].iloc[i] else 'green' for i in range(len(hist))]
-        fig.add_trace(go.Bar(x=hist.index, y=hist['Volume'], name='Volume', marker_color=colors), row=2, col=1)
-        fig.update_layout(height=600, xaxis_rangeslider_visible=False, showlegend=False, hovermode='x unified')
-        fig.update_xaxes(title_text="Tanggal", row=2, col=1)
-        fig.update_yaxes(title_text="Harga (IDR)", row=1, col=1)
-        fig.update_yaxes(title_text="Volume", row=2, col=1)
-        return fig
-    except Exception:
-        return None
-
-def process_single_stock(ticker, min_trading_value, price_threshold, num_consecutive_days=2, include_indicators=False, name_map=None):
+def compute_indicators(hist):
+    """RSI/SMA/EMA/volume trend dari satu kali ambil array Close & Volume."""
+    close = hist['Close'].to_numpy(dtype=np.float32)
+    volumes = hist['Volume'].to_numpy(copy=False)  # .mean() tetap float64, tak perlu salin ke float
+    return {
+        'rsi': calculate_rsi(close, 14),
+        'sma20': calculate_sma(close, 20),
+        'ema20': calculate_ema(close, 20),
+        'vtrend': calculate_volume_trend(volumes, 5),
+    }
+
+_BASE_LAYOUT = dict(height=600, xaxis_rangeslider_visible=False, showlegend=False, hovermode='x unified')
+
+@st.cache_resource(show_spinner=False)
+def _chart_template():
+    # kerangka subplot, layout & dua trace sama untuk semua saham → dibangun sekali, per grafik tinggal isi data
+    from plotly.subplots import make_subplots
+    import plotly.graph_objects as go
+    fig = make_subplots(
+        rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.03,
+        subplot_titles=('Harga', 'Volume'),
+        row_heights=[0.7, 0.3]
+    )
+    fig.update_layout(**_BASE_LAYOUT)
+    fig.update_xaxes(title_text="Tanggal", row=2, col=1)
+    fig.update_yaxes(title_text="Harga (IDR)", row=1, col=1)
+    fig.update_yaxes(title_text="Volume", row=2, col=1)
+    fig.add_trace(go.Candlestick(name='Price'), row=1, col=1)
+    fig.add_trace(go.Bar(name='Volume'), row=2, col=1)
+    return fig
+
+# name_map hanya untuk label judul → tidak ikut di-hash (hash dict ratusan emiten tiap panggilan itu mahal)
+@st.cache_data(ttl=600, show_spinner=False, hash_funcs={dict: lambda d: None})
+def create_stock_chart(ticker, period="3mo", name_map=None, hist=None):
+    # error sengaja tidak ditangkap di sini: exception tidak di-cache, jadi gangguan sesaat dicoba lagi
+    if hist is None:
+        # sama dengan data scan (auto_adjust=False) → grafik sama, apa pun jalurnya
+        hist = _ticker(ticker).history(period=period, auto_adjust=False)
+    if hist is None or len(hist) < 1:
+        # yfinance mengembalikan frame kosong saat gagal → diperlakukan sebagai error juga
+        raise ValueError(f"tidak ada data harga untuk {ticker}")
+    stock_name = (name_map or {}).get(ticker) or ticker.replace(".JK", "")
+    import plotly.graph_objects as go
+    fig = go.Figure(_chart_template())  # salinan, template tidak ikut berubah
+    fig.layout.annotations[0].text = f'{stock_name} ({ticker.replace(".JK", "")})'
+    fig.data[0].update(x=hist.index, open=hist['Open'], high=hist['High'], low=hist['Low'], close=hist['Close'])
+    colors = np.where(hist['Close'].to_numpy() < hist['Open'].to_numpy(), 'red', 'green').tolist()
+    fig.data[1].update(x=hist.index, y=hist['Volume'], marker_color=colors)
+    return fig
+
+@st.fragment
+def render_chart(code, ticker, name_map=None):
+    # isi expander selalu dijalankan → grafik baru diunduh kalau diminta, dan klik hanya me-rerun fragment ini
+    if not st.toggle("Tampilkan grafik", key=f"chart_{code}"):
+        return
+    with st.spinner(f"Memuat grafik {code}..."):
+        try:
+            fig = create_stock_chart(ticker, name_map=name_map, hist=st.session_state.get('hist_cache', {}).get(ticker))
+        except Exception:
+            fig = None
+        if fig:
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.error("Gagal memuat grafik untuk saham ini")
+
+def scan_period(num_consecutive_days):
+    # 5d kadang cuma berisi 4 hari bursa (libur) → untuk 4-5 hari berturut-turut ambil 1mo
+    return "5d" if num_consecutive_days <= 3 else "1mo"
+
+def indicator_columns(hist):
+    ind = compute_indicators(hist)
+    return {
+        'RSI (14)': ind['rsi'],
+        'SMA (20)': ind['sma20'],
+        'EMA (20)': ind['ema20'],
+        'Volume Trend (%)': ind['vtrend'],
+    }
+
+def process_single_stock(ticker, min_trading_value, price_threshold, num_consecutive_days=2, include_indicators=False, name_map=None, hist=None, long_hist=None):
     try:
-        period = "3mo" if include_indicators else "5d"
-        hist, info = get_stock_data(ticker, period=period)
+        if hist is None:
+            # tidak ada di hasil batch → ambil satu per satu
+            hist = get_stock_data(ticker, period=scan_period(num_consecutive_days))
         if hist is not None and len(hist) >= (num_consecutive_days + 1):
-            ok, changes, prices = check_consecutive_day_increase(hist, price_threshold, num_consecutive_days)
+            # kolom diambil sekali sebagai array, dipakai semua pengecekan
+            close = hist['Close'].to_numpy(copy=False)
+            ok, changes, prices = check_consecutive_day_increase(close, price_threshold, num_consecutive_days)
             if ok:
-                tv = calculate_trading_value(hist)
+                tv = calculate_trading_value(close, hist['Volume'].to_numpy(copy=False))
                 if tv >= min_trading_value:
                     code = ticker.replace(".JK", "")
-                    name = (name_map or {}).get(ticker) or info.get('longName') or code
+                    # nama dari daftar emiten; tanpa .info (scrape terpisah yang lambat)
+                    name = (name_map or {}).get(ticker) or code
                     row = {
                         'Kode': code,
                         'Nama': name,
                         'Harga Sekarang': prices[-1],
                         'Nilai Transaksi Harian': tv,
-                        'Nilai Transaksi (Format)': format_idr(tv),
                     }
                     for i, ch in enumerate(changes):
-                        row[f"Kenaikan Hari -{len(changes)-i}"] = f"{ch:.2f}%"
+                        row[f"Kenaikan Hari -{len(changes)-i}"] = ch
                     if include_indicators:
-                        rsi = calculate_rsi(hist)
-                        sma20 = calculate_sma(hist, 20)
-                        ema20 = calculate_ema(hist, 20)
-                        vtrend = calculate_volume_trend(hist)
-                        row['RSI (14)'] = f"{rsi:.2f}" if rsi is not None else "N/A"
-                        row['SMA (20)'] = f"{sma20:.2f}" if sma20 is not None else "N/A"
-                        row['EMA (20)'] = f"{ema20:.2f}" if ema20 is not None else "N/A"
-                        row['Volume Trend (%)'] = f"{vtrend:.2f}" if vtrend is not None else "N/A"
-                    return {'success': True, 'data': row}
+                        # data 3 bulan hanya untuk saham yang sudah lolos filter di atas
+                        if long_hist is None:
+                            long_hist = get_stock_data(ticker, period="3mo", columns=OHLCV_COLUMNS)
+                        row.update(indicator_columns(long_hist))
+                    # data 3 bulan ini dipakai ulang untuk grafik
+                    return {'success': True, 'data': row, 'hist': long_hist if include_indicators else None}
         return {'success': True, 'data': None}
     except Exception as e:
         return {'success': False, 'error': str(e), 'ticker': ticker}
 
+# ---------- Tampilan hasil ----------
+BASE_COLS = ['Kode', 'Nama', 'Harga Sekarang']
+INDICATOR_COLS = ['RSI (14)', 'SMA (20)', 'EMA (20)', 'Volume Trend (%)']
+
+def results_frame(rows):
+    # angka disimpan mentah (bukan string) → ringan & CSV tetap numerik
+    df = pd.DataFrame(rows)
+    if not df.empty:
+        df = df.astype({'Harga Sekarang': 'float32', 'Nilai Transaksi Harian': 'float64'})
+    return df
+
+def results_display(df):
+    """Proyeksi untuk tabel: format teks hanya dibuat di sini, saat render."""
+    change_cols = sorted((c for c in df.columns if c.startswith('Kenaikan Hari')), reverse=True)
+    ind_cols = INDICATOR_COLS if INDICATOR_COLS[0] in df.columns else []
+    out = df[BASE_COLS + change_cols + ['Nilai Transaksi Harian'] + ind_cols].copy()
+    out['Harga Sekarang'] = out['Harga Sekarang'].astype('float64').round(2)  # buang ekor float32, tetap bisa diurutkan
+    out[change_cols] = out[change_cols].map("{:.2f}%".format)
+    out['Nilai Transaksi Harian'] = out['Nilai Transaksi Harian'].map(format_idr)
+    if ind_cols:
+        out[ind_cols] = out[ind_cols].map(lambda v: "N/A" if pd.isna(v) else f"{v:.2f}")
+    return out
+
+def results_to_csv(df):
+    # langsung ditulis sebagai bytes; float32 dibulatkan agar tak ada ekor 99.80000305
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, float_format="%.4f")
+    return buf.getvalue()
+
 def scan_stocks_with_progress(tickers, min_trading_value=15_000_000_000, price_threshold=2.0, num_consecutive_days=2, include_indicators=False, name_map=None):
-    filtered, failed = [], []
-    progress_bar = st.progress(0); status_text = st.empty()
+    rows, failed, hist_cache = {}, [], {}
+    progress_bar = st.progress(0); status_text = st.empty(); results_slot = st.empty()
     total = len(tickers)
-    for idx, t in enumerate(tickers):
-        status_text.text(f"Scanning {t}... ({idx+1}/{total})")
-        res = process_single_stock(t, min_trading_value, price_threshold, num_consecutive_days, include_indicators, name_map)
-        if res['success']:
-            if res['data'] is not None:
-                filtered.append(res['data'])
-        else:
-            failed.append({'ticker': res['ticker'], 'error': res['error']})
-        if (idx + 1) % 50 == 0:
-            time.sleep(1.0)
-        progress_bar.progress((idx + 1) / max(total, 1))
-    progress_bar.empty(); status_text.empty()
+    if total:
+        shown = [0]  # jumlah hasil yang sudah tampil sementara
+        bulk_done = [0]  # ticker yang sudah diproses dari data batch
+
+        def _stream():
+            # hasil sementara tampil selagi scan jalan; digambar ulang hanya jika ada yang baru
+            if len(rows) > shown[0]:
+                shown[0] = len(rows)
+                partial = results_frame([rows[k] for k in tickers if k in rows])
+                results_slot.dataframe(results_display(partial), width="stretch", hide_index=True)
+
+        def _collect(t, res):
+            if res['success']:
+                if res['data'] is not None:
+                    rows[t] = res['data']
+                if res.get('hist') is not None:
+                    hist_cache[t] = res['hist']
+            else:
+                failed.append({'ticker': res['ticker'], 'error': res['error']})
+
+        args = (min_trading_value, price_threshold, num_consecutive_days, False, name_map)
+
+        def _on_chunk(done, n, batch):
+            # data chunk ini sudah ada → murni hitungan CPU yang singkat, langsung di thread utama
+            for t, hist in batch.items():
+                _collect(t, process_single_stock(t, *args, hist))
+            bulk_done[0] += len(batch)
+            # progress = ticker selesai dari seluruh scan → tak mundur saat lanjut ke thread pool
+            status_text.text(f"Mengunduh & memfilter data harga... ({bulk_done[0]}/{total})")
+            progress_bar.progress(bulk_done[0] / total)
+            _stream()  # sekali per chunk, saat memang ada data baru dari jaringan
+
+        # tahap 1: filter kenaikan & nilai transaksi cukup pakai data beberapa hari
+        histories = fetch_histories_batched(list(tickers), period=scan_period(num_consecutive_days), on_chunk=_on_chunk)
+        # sisanya perlu request per ticker (network-bound) → thread pool
+        pending = [t for t in tickers if t not in histories]
+        if pending:
+            n_pending = len(pending)
+            step = max(1, n_pending // 100)
+            with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, n_pending)) as ex:
+                futures = {ex.submit(process_single_stock, t, *args): t for t in pending}
+                for i, fut in enumerate(as_completed(futures), 1):
+                    t = futures[fut]
+                    _collect(t, fut.result())
+                    # tiap update UI = satu pesan websocket → cukup ~100 kali per scan
+                    if i % step == 0 or i == n_pending:
+                        status_text.text(f"Scanning {t}... ({bulk_done[0] + i}/{total})")
+                        progress_bar.progress((bulk_done[0] + i) / total)
+                    if i % STREAM_EVERY == 0 or i == n_pending:
+                        _stream()
+        # tahap 2: data 3 bulan + indikator hanya untuk saham yang lolos
+        if include_indicators and rows:
+            hits = [t for t in tickers if t in rows]
+            status_text.text(f"Menghitung indikator untuk {len(hits)} saham...")
+            long_histories = fetch_histories_batched(hits, period="3mo", columns=OHLCV_COLUMNS)
+            for t in hits:
+                res = process_single_stock(t, min_trading_value, price_threshold, num_consecutive_days, True, name_map, histories.get(t), long_histories.get(t))
+                if not res['success']:
+                    # data 3 bulan gagal → dilaporkan, baris tanpa indikator tetap tampil
+                    failed.append({'ticker': res['ticker'], 'error': res['error']})
+                elif res['data'] is not None:
+                    rows[t] = res['data']
+                    if res['hist'] is not None and len(res['hist']):
+                        # frame kosong tidak disimpan → grafik masih bisa ambil ulang sendiri
+                        hist_cache[t] = res['hist']
+    progress_bar.empty(); status_text.empty(); results_slot.empty()
+    st.session_state['hist_cache'] = hist_cache
+    # urutan hasil mengikuti daftar ticker, bukan urutan selesai
+    filtered = [rows[t] for t in tickers if t in rows]
     if failed:
         with st.expander(f"⚠️ {len(failed)} saham gagal dimuat (klik untuk detail)", expanded=False):
             st.dataframe(pd.DataFrame(failed), use_container_width=True, hide_index=True)
-    return pd.DataFrame(filtered), failed
+    return results_frame(filtered), failed
 
 # ---------- Sidebar Controls ----------
 st.sidebar.header("⚙️ Sumber Daftar Emiten")
@@ -348,6 +577,7 @@ if source_mode == "Manual":
 if st.sidebar.button("🔄 Clear Cache (fetch ulang)"):
     fetch_from_yahoo_search_verbose.clear()
     fetch_from_idx_verbose.clear()
+    _fetch_listing.clear()
     st.sidebar.success("Cache dihapus, daftar akan diambil ulang.")
 
 with st.spinner("Mengambil daftar emiten..."):
@@ -362,7 +592,7 @@ with st.expander("🔎 Debug koneksi & daftar emiten (opsional)"):
             st.write("•", m)
     # quick connectivity test to Yahoo price for BBCA.JK
     try:
-        _h = yf.Ticker("BBCA.JK").history(period="5d")
+        _h = _ticker("BBCA.JK").history(period="5d")
         st.write(f"Tes harga BBCA.JK: rows={len(_h)} (>=1 artinya koneksi harga OK)")
     except Exception as e:
         st.write(f"Tes harga BBCA.JK gagal: {e}")
@@ -400,6 +630,8 @@ if st.sidebar.button("🔍 Scan Saham", type="primary"):
     )
     st.session_state['results'] = results
     st.session_state['errors'] = errors
+    # CSV cukup dibuat sekali per scan, bukan di setiap rerun
+    st.session_state['results_csv'] = results_to_csv(results)
 
 auto_refresh = st.sidebar.checkbox("Auto Refresh (5 menit)", value=False)
 if auto_refresh:
@@ -409,15 +641,9 @@ if auto_refresh:
 if 'results' in st.session_state and not st.session_state['results'].empty:
     df = st.session_state['results']
     st.success(f"✅ Ditemukan {len(df)} saham yang memenuhi kriteria!")
-    base_cols = ['Kode', 'Nama', 'Harga Sekarang']
-    change_cols = sorted([c for c in df.columns if c.startswith('Kenaikan Hari')], reverse=True)
-    display_cols = base_cols + change_cols + ['Nilai Transaksi (Format)']
-    if 'RSI (14)' in df.columns:
-        display_cols += ['RSI (14)', 'SMA (20)', 'EMA (20)', 'Volume Trend (%)']
-    display_df = df[display_cols].rename(columns={'Nilai Transaksi (Format)': 'Nilai Transaksi Harian'})
-    st.dataframe(display_df, use_container_width=True, hide_index=True)
-
-    csv = df.to_csv(index=False)
+    st.dataframe(results_display(df), use_container_width=True, hide_index=True)
+
+    csv = st.session_state.get('results_csv') or results_to_csv(df)
     st.download_button(
         label="📥 Download Data (CSV)",
         data=csv,
@@ -427,7 +653,7 @@ if 'results' in st.session_state and not st.session_state['results'].empty:
 
     st.markdown("---")
     st.markdown("### 📊 Grafik Harga Saham")
-    st.markdown("Klik pada saham untuk melihat grafik harga historis")
+    st.markdown("Klik pada saham lalu aktifkan 'Tampilkan grafik' untuk melihat grafik harga historis")
 
     cols_per_row = 2
     rows = (len(df) + cols_per_row - 1) // cols_per_row
@@ -440,12 +666,7 @@ if 'results' in st.session_state and not st.session_state['results'].empty:
                 code = row['Kode']; name = row['Nama']; tkr = f"{code}.JK"
                 with cols[c]:
                     with st.expander(f"📈 {code} - {name}"):
-                        with st.spinner(f"Memuat grafik {code}..."):
-                            fig = create_stock_chart(tkr, name_map=NAME_MAP)
-                            if fig:
-                                st.plotly_chart(fig, use_container_width=True)
-                            else:
-                                st.error("Gagal memuat grafik untuk saham ini")
+                        render_chart(code, tkr, NAME_MAP)
 elif 'results' in st.session_state and st.session_state['results'].empty:
     st.warning("⚠️ Tidak ada saham yang memenuhi kriteria pada scan terakhir.")
 else:
@@ -0,0 +1,32 @@
+# Kernel Numba untuk indikator. Modul terpisah supaya dispatcher & warm-up JIT
+# cuma jalan sekali per proses, bukan di setiap rerun Streamlit atas app.py.
+import numpy as np
+from numba import njit
+
+@njit(cache=True, fastmath=True)
+def rsi_ewm(prices, period):
+    # Wilder smoothing (ewm alpha=1/period, adjust=False); rata-rata mulai dari 0 seperti baris pertama diff()
+    alpha = 1.0 / period
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, prices.shape[0]):
+        delta = prices[i] - prices[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        avg_gain = alpha * gain + (1.0 - alpha) * avg_gain
+        avg_loss = alpha * loss + (1.0 - alpha) * avg_loss
+    return avg_gain, avg_loss
+
+@njit(cache=True, fastmath=True)
+def ema_last(prices, span):
+    # setara .ewm(span=span, adjust=False).mean() elemen terakhir
+    alpha = 2.0 / (span + 1)
+    ema = prices[0]
+    for i in range(1, prices.shape[0]):
+        ema = alpha * prices[i] + (1.0 - alpha) * ema
+    return ema
+
+# kompilasi JIT saat import (tipe float32 sama seperti compute_indicators) → scan pertama tak tertahan
+_WARMUP = np.arange(1, 4, dtype=np.float32)
+rsi_ewm(_WARMUP, 14)
+ema_last(_WARMUP, 20)